@@ -1,288 +1,816 @@
-"""
-AutoMatcher: модуль обработки данных.
-Основные функции:
-- Конвертация Excel в SQLite.
-- Поиск совпадений через алгоритм BM25.
-- Фильтрация и ранжирование товаров.
-"""
-import pandas as pd
-import sqlite3
-import os
-from pathlib import Path
-from rank_bm25 import BM25Okapi
-
-
-class DataProcessor:
-    def __init__(self):
-        """Инициализация обработчика данных."""
-        self.nomenclature_df = None
-        self.request_df = None
-        self.replacements = {
-            'перманентный': 'перм', 'маркер': 'марк', 'мультифора': 'файл',
-            'грузоподъемностью': 'груз', 'пластиковый': 'пласт', 'металлический': 'мет',
-            'тн': 'тонн', 'корректирующее': 'корр', 'самоклеящаяся': 'самокл',
-            'гибкая': 'гибк', 'регистратор': 'регистр', 'кальцинированная': 'кальц',
-            'гост': 'стандарт', 'ассорти': 'разные цвета', 'арочный': 'дуга'
-        }
-
-    def convert_excel_to_sqlite(self, excel_path, db_path, table_name):
-        """Конвертирует Excel-файл в SQLite-базу.
-                Args:
-                    excel_path (str): Путь к Excel-файлу.
-                    db_path (str): Путь для сохранения SQLite-базы.
-                    table_name (str): Название таблицы.
-                """
-        try:
-            df = pd.read_excel(excel_path, engine='openpyxl')
-            conn = sqlite3.connect(db_path)
-            df.to_sql(table_name, conn, if_exists='replace', index=False)
-            conn.close()
-        except Exception as e:
-            raise Exception(f"Ошибка конвертации: {str(e)}")
-
-    def load_nomenclature_data(self, path):
-        """Загружает данные номенклатуры из Excel или SQLite.
-                Args:
-                    path (str): Путь к Excel-файлу.
-                """
-
-        # Если базы нет, конвертируем Excel в SQLite
-        db_path = Path(path).with_suffix('.db')
-        if not os.path.exists(db_path):
-            self.convert_excel_to_sqlite(path, db_path, 'nomenclature')
-
-        # Загрузка данных из SQLite
-        conn = sqlite3.connect(db_path)
-        self.nomenclature_df = pd.read_sql('SELECT * FROM nomenclature', conn)
-        conn.close()
-
-        # Добавление недостающих колонок
-        required_cols = ['Номенклатура', 'Код', 'Оформлено',
-                         'ТоварПроизводителя', 'ОсновнойАссортимент']
-        for col in required_cols:
-            if col not in self.nomenclature_df.columns:
-                self.nomenclature_df[col] = 'Нет' # Значение по умолчанию
-
-    def save_results(self, results, path):
-        """Сохраняет результаты поиска в файл (Excel/CSV).
-            Args:
-                results (list): Список словарей с результатами.
-                path (str): Путь для сохранения файла.
-            """
-        df = pd.DataFrame(results)
-
-        # Конвертация строковых значений 'Сходство' в числовой формат
-        if 'Сходство' in df.columns:
-            df['Сходство'] = df['Сходство'].astype(float)
-
-        # Выбор формата экспорта с учетом локализации для CSV
-        if path.endswith('.xlsx'):
-            df.to_excel(path, index=False)
-        elif path.endswith('.csv'):
-            # Использование ';' как разделителя и ',' для десятичных
-            df.to_csv(path, index=False, sep=';', decimal=',')
-        else:
-            raise ValueError("Неподдерживаемый формат файла")
-
-    def update_progress(self, current, total):
-        pass
-
-    def process_grouped_requests(self, selected_columns, priority, top_n):
-        """Обрабатывает группированные запросы.
-                Args:
-                    selected_columns (list): Колонки для группировки.
-                    priority (str): Приоритет сортировки (например, 'Оформлено').
-                    top_n (int): Количество возвращаемых вариантов.
-                Returns:
-                    list: Результаты поиска.
-                """
-        # Проверка загрузки данных
-        if self.request_df is None or self.nomenclature_df is None:
-            raise ValueError("Данные не загружены")
-
-        # Группировка запросов по выбранным колонкам
-        self.request_df['combined_key'] = self.request_df[selected_columns].astype(str).agg(' | '.join, axis=1)
-        grouped = self.request_df.groupby('combined_key')
-
-        # Подготовка данных для BM25
-        self.nomenclature_df['processed'] = self.nomenclature_df['Номенклатура'].apply(self.preprocess_text)
-        tokenized_names = [text.split() for text in self.nomenclature_df['processed']]
-        bm25 = BM25Okapi(tokenized_names)  # Инициализация модели BM25
-
-        results = []
-        total_groups = len(grouped)
-
-        # Обработка каждой группы запросов
-        for group_idx, (group_name, group_df) in enumerate(grouped):
-            group_results = []
-
-            # Сбор частей запроса из группы
-            query_parts = []
-            for _, row in group_df.iterrows():
-                parts = [str(row[col]) for col in selected_columns if pd.notna(row[col])]
-                query_parts.extend(parts)
-
-            # Формирование уникального запроса
-            unique_query = ' '.join(sorted(set(query_parts), key=query_parts.index))
-            processed_query = self.preprocess_text(unique_query).split()
-
-            # Расчет релевантности через BM25
-            scores = bm25.get_scores(processed_query)
-            min_score, max_score = min(scores), max(scores)
-
-            # Нормализация оценок в диапазон 0-100
-            if max_score == min_score:
-                normalized = [100] * len(scores) if max_score > 0 else [0] * len(scores)
-            else:
-                normalized = [(s - min_score) / (max_score - min_score) * 100 for s in scores]
-
-            # Бонус за совпадение начала
-            for idx, name in enumerate(self.nomenclature_df['processed']):
-                if name.startswith(' '.join(processed_query)):
-                    normalized[idx] = min(normalized[idx] + 5, 100)
-
-            # Сортировка и фильтрация результатов
-            temp_df = self.nomenclature_df.copy()
-            temp_df['similarity'] = normalized
-            sorted_df = temp_df.sort_values(
-                [priority, 'similarity'],
-                ascending=[False, False]
-            ).head(top_n * 2)  # Взято в 2 раза больше для отсева дубликатов
-
-            # Фильтрация
-            unique_codes = set()
-            for _, row in sorted_df.iterrows():
-                if row['Код'] not in unique_codes:
-                    group_results.append({
-                        'Запрос': group_name,
-                        'Номенклатура': row['Номенклатура'],
-                        'Код': row['Код'],
-                        'Сходство': row['similarity'],
-                        'Статус': self.get_status(row)
-                    })
-                    unique_codes.add(row['Код'])
-                    if len(unique_codes) >= top_n:
-                        break
-
-            results.extend(group_results)
-            self.update_progress(group_idx + 1, total_groups)
-
-        return results
-
-    def load_request_data(self, path):
-        """Загружает данные клиентской заявки из Excel.
-            Особенности:
-            - Автоматически определяет строку с заголовками
-            - Игнорирует технические колонки ('Unnamed')
-            - Заполняет пропущенные значения предыдущими
-            """
-
-        # Поиск заголовка в первых 10 строках
-        temp_df = pd.read_excel(path, header=None, nrows=10, engine='openpyxl')
-        header_row = self.find_header_row(temp_df)
-
-        # Чтение данных с фильтрацией ненужных колонок
-        self.request_df = pd.read_excel(
-            path,
-            header=header_row,
-            engine='openpyxl',
-            usecols=lambda x: 'Unnamed' not in str(x)   # Игнорирование служебных колонок
-        ).dropna(how='all').ffill()        # Удаление пустых строк и заполнение пропусков
-
-    def find_header_row(self, df):
-        """Ищет строку с заголовками таблицы по наличию слова 'товар'.
-            Возвращает:
-                int: Номер строки с заголовком (0 если не найден).
-            """
-        for idx, row in df.iterrows():
-            if any('товар' in str(cell).lower() for cell in row):
-                return idx
-        return 0  # Возврат первой строки как заголовка по умолчанию
-
-    def preprocess_text(self, text):
-        """Предобработка текста для поиска:
-            1. Приведение к нижнему регистру
-            2. Удаление спецсимволов (остаются буквы, цифры и пробелы)
-            3. Замена слов по словарю сокращений
-            """
-        text = str(text).lower()
-        cleaned = [char for char in text if char.isalnum() or char.isspace()]
-        text = ''.join(cleaned)
-
-        for k, v in self.replacements.items(): # Применение замен из словаря
-            text = text.replace(k, v)
-        return text
-
-    def process_data(self, column_name, priority_var, top_n, progress_callback=None):
-        """Основной метод обработки данных. Этапы:
-            1. Препроцессинг названий товаров
-            2. Построение модели BM25
-            3. Итеративная обработка каждого запроса
-            4. Нормализация оценок и добавление бонусов
-            5. Фильтрация и сохранение результатов
-            """
-
-        # Токенизация названий для BM25
-        self.nomenclature_df['processed'] = self.nomenclature_df['Номенклатура'].apply(self.preprocess_text)
-        tokenized_names = [text.split() for text in self.nomenclature_df['processed']]
-        bm25 = BM25Okapi(tokenized_names)
-
-        results = []
-        total_queries = len(self.request_df[column_name])
-        processed_count = 0
-        for idx, query in enumerate(self.request_df[self.column_var.get()]):
-            if self.cancel_flag:
-                break  # Прерывание при отмене
-
-            processed_query = self.preprocess_text(query).split()
-            scores = bm25.get_scores(processed_query)
-
-            # Нормализация оценок в диапазон 0-100
-            min_score, max_score = min(scores), max(scores)
-            if max_score == min_score:
-                normalized = [100] * len(scores) if max_score > 0 else [0] * len(scores)
-            else:
-                normalized = [(s - min_score) / (max_score - min_score) * 100 for s in scores]
-
-            # Бонус за совпадение начала строки
-            for idx_name, name in enumerate(self.nomenclature_df['processed']):
-                if name.startswith(' '.join(processed_query)):
-                    normalized[idx_name] = min(normalized[idx_name] + 5, 100)
-
-            # Сортировка и выбор топ-N результатов
-            results = self.nomenclature_df.copy()
-            results['similarity'] = normalized
-            results = results.sort_values(
-                [priority_var, 'similarity'],
-                ascending=[False, False]
-            ).head(int(top_n))
-
-            # Формирование итоговой структуры
-            for _, row in results.iterrows():
-                self.results.append({
-                    'Запрос': query,
-                    'Номенклатура': row['Номенклатура'],
-                    'Код': row['Код'],
-                    'Сходство': f"{row['similarity']:.2f}",
-                    'Статус': self.get_status(row)
-                })
-            # Дополнительное обновление прогресса каждые 10 запросов
-            processed_count += 1
-            if processed_count % 10 == 0 or processed_count == total_queries:
-                progress = processed_count / total_queries * 100
-                if progress_callback:
-                    progress_callback(progress)
-        return results
-
-    def get_status(self, row):
-        """Формирует строку статусов товара на основе флагов.
-            Возможные статусы:
-            - Оформлено
-            - Товар Производителя
-            - Основной Ассортимент
-            """
-        status = []
-        if row['Оформлено'] == 'Да': status.append("Оформлено")
-        if row['ТоварПроизводителя'] == 'Да': status.append("Товар Производителя")
-        if row['ОсновнойАссортимент'] == 'Да': status.append("Основной Ассортимент")
+"""
+AutoMatcher: модуль обработки данных.
+Основные функции:
+- Конвертация Excel в SQLite.
+- Поиск совпадений через алгоритм BM25.
+- Фильтрация и ранжирование товаров.
+"""
+import pandas as pd
+import polars as pl
+import numpy as np
+import re
+import sqlite3
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from scipy import sparse
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:    # numba — необязательная зависимость
+    NUMBA_AVAILABLE = False
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:    # pyahocorasick — необязательная зависимость
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    from joblib import Parallel, delayed
+    JOBLIB_AVAILABLE = True
+except ImportError:    # joblib — необязательная зависимость
+    JOBLIB_AVAILABLE = False
+
+_numba_scorer_enabled = False
+
+
+@dataclass
+class BM25State:
+    """Состояние индекса BM25, построенное один раз на загруженный файл."""
+    processed: pl.Series        # Предобработанные названия
+    tokenized: list             # Токены по документам
+    joined: np.ndarray          # Склеенные токены (бонус за начало)
+    vocab: dict                 # Терм -> индекс
+    matrix: sparse.csr_matrix   # Готовые веса BM25 (документы × словарь)
+    idf: np.ndarray
+    tf_indptr: np.ndarray       # Списки вхождений (CSC: терм -> документы)
+    tf_indices: np.ndarray
+    tf_data: np.ndarray
+    doc_len: np.ndarray
+    avgdl: float
+    k1: float
+    b: float
+    idf_k1: np.ndarray          # float32-массивы для JIT-ядра
+    k1_k_d: np.ndarray
+    max_contrib: np.ndarray     # Верхние границы вкладов (MaxScore)
+
+
+def activate_numba_scorer(enabled=True):
+    """Включает JIT-ядро numba для оценки BM25.
+        Args:
+            enabled (bool): True — использовать ядро numba,
+                False — вернуться к разреженному умножению scipy.
+        Raises:
+            ImportError: Если numba не установлена.
+        """
+    global _numba_scorer_enabled
+    if enabled and not NUMBA_AVAILABLE:
+        raise ImportError("Для JIT-оценки BM25 требуется пакет numba")
+    _numba_scorer_enabled = enabled
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _bm25_scores_batch(query_indptr, query_term_ids, idf_k1,
+                           tf_indptr, tf_indices, tf_data, k1_k_d, out):
+        """JIT-ядро: оценки BM25 для пакета запросов по спискам вхождений.
+            Запросы обрабатываются параллельно (prange); для каждого терма
+            запроса его вклад рассеивается по документам из списка вхождений.
+            Внутренний цикл сведен к float32-операциям над предвычисленными
+            массивами idf*(k1+1) и k1*(1 - b + b*dl/avgdl) — fastmath
+            позволяет LLVM векторизовать его (FMA/AVX2 или NEON).
+            """
+        for query_id in prange(query_indptr.shape[0] - 1):
+            for j in range(query_indptr[query_id], query_indptr[query_id + 1]):
+                term_id = query_term_ids[j]
+                contrib = idf_k1[term_id]
+                for p in range(tf_indptr[term_id], tf_indptr[term_id + 1]):
+                    doc_id = tf_indices[p]
+                    tf = np.float32(tf_data[p])
+                    out[query_id, doc_id] += contrib * tf / (tf + k1_k_d[doc_id])
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _bm25_scores_batch_pruned(query_indptr, query_term_ids, idf_k1,
+                                  tf_indptr, tf_indices, tf_data, k1_k_d,
+                                  max_contrib, top_k, out):
+        """JIT-ядро с отсечением MaxScore: нужны только top_k документов.
+            Термы запроса обрабатываются по убыванию максимального вклада;
+            документ, который даже с верхней границей оставшихся термов
+            не догоняет текущую k-ю оценку, пропускается. Итоговый top_k
+            по сырой оценке BM25 совпадает с полным перебором, но хвост
+            оценок занижен — ядро непригодно, если вызывающий код
+            переранжирует результат по другому ключу.
+            """
+        num_docs = out.shape[1]
+        for query_id in prange(query_indptr.shape[0] - 1):
+            start = query_indptr[query_id]
+            end = query_indptr[query_id + 1]
+            n_terms = end - start
+            if n_terms == 0:
+                continue
+
+            # Сортировка термов по убыванию максимального вклада
+            bounds = np.empty(n_terms, dtype=np.float32)
+            for i in range(n_terms):
+                bounds[i] = max_contrib[query_term_ids[start + i]]
+            order = np.argsort(-bounds)
+
+            # Суффиксные суммы верхних границ оставшихся термов
+            upper = np.empty(n_terms + 1, dtype=np.float32)
+            upper[n_terms] = 0.0
+            for i in range(n_terms - 1, -1, -1):
+                upper[i] = upper[i + 1] + bounds[order[i]]
+
+            threshold = np.float32(-1.0)
+            for i in range(n_terms):
+                term_id = query_term_ids[start + order[i]]
+                contrib = idf_k1[term_id]
+                upper_remaining = upper[i]
+                for p in range(tf_indptr[term_id], tf_indptr[term_id + 1]):
+                    doc_id = tf_indices[p]
+                    if threshold >= 0 and out[query_id, doc_id] + upper_remaining < threshold:
+                        continue    # Документ уже не попадет в top_k
+                    tf = np.float32(tf_data[p])
+                    out[query_id, doc_id] += contrib * tf / (tf + k1_k_d[doc_id])
+                # Порог отсечения — текущая k-я лучшая оценка
+                if top_k < num_docs:
+                    threshold = np.partition(out[query_id], num_docs - top_k)[num_docs - top_k]
+
+
+class DataProcessor:
+    def __init__(self):
+        """Инициализация обработчика данных."""
+        self.nomenclature_df = None
+        self.request_df = None
+        self._bm25_cache = {}        # Кэш индексов BM25 по ключу (путь, mtime)
+        self._nomenclature_key = None
+        self._status_arr = None      # Готовые строки статусов по позициям
+        self.replacements = {
+            'перманентный': 'перм', 'маркер': 'марк', 'мультифора': 'файл',
+            'грузоподъемностью': 'груз', 'пластиковый': 'пласт', 'металлический': 'мет',
+            'тн': 'тонн', 'корректирующее': 'корр', 'самоклеящаяся': 'самокл',
+            'гибкая': 'гибк', 'регистратор': 'регистр', 'кальцинированная': 'кальц',
+            'гост': 'стандарт', 'ассорти': 'разные цвета', 'арочный': 'дуга'
+        }
+        # Скомпилированные регулярные выражения для предобработки:
+        # удаление спецсимволов и все замены одним проходом (альтернация)
+        self._nonword_re = re.compile(r'[^\w\s]+')
+        self._replace_re = re.compile('|'.join(map(re.escape, self.replacements)))
+        self._replace_match = lambda match: self.replacements[match.group(0)]
+
+        # Автомат Ахо-Корасик: все замены за один проход по строке
+        if AHOCORASICK_AVAILABLE:
+            self._aho = ahocorasick.Automaton()
+            for key, value in self.replacements.items():
+                self._aho.add_word(key, (len(key), value))
+            self._aho.make_automaton()
+        else:
+            self._aho = None
+
+    def convert_excel_to_sqlite(self, excel_path, db_path, table_name):
+        """Конвертирует Excel-файл в SQLite-базу.
+                Args:
+                    excel_path (str): Путь к Excel-файлу.
+                    db_path (str): Путь для сохранения SQLite-базы.
+                    table_name (str): Название таблицы.
+                """
+        try:
+            try:
+                # Rust-парсер calamine в разы быстрее openpyxl
+                df = pd.read_excel(excel_path, engine='calamine')
+            except ImportError:    # python-calamine не установлен
+                df = pd.read_excel(excel_path, engine='openpyxl')
+            conn = sqlite3.connect(db_path)
+            # Ускорение массовой записи: WAL, mmap и без fsync на транзакцию
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA mmap_size=268435456')
+            conn.execute('PRAGMA synchronous=OFF')
+            df.to_sql(table_name, conn, if_exists='replace', index=False)
+            conn.close()
+        except Exception as e:
+            raise Exception(f"Ошибка конвертации: {str(e)}")
+
+    def load_nomenclature_data(self, path):
+        """Загружает данные номенклатуры из Excel или SQLite.
+                Args:
+                    path (str): Путь к Excel-файлу.
+                """
+
+        # Parquet-кэш: колоночный формат без двойного прохода через SQLite
+        parquet_path = Path(path).with_suffix('.parquet')
+        db_path = Path(path).with_suffix('.db')
+        if (os.path.exists(parquet_path)
+                and os.path.getmtime(parquet_path) >= os.path.getmtime(path)):
+            self.nomenclature_df = pl.read_parquet(parquet_path)
+        elif os.path.exists(db_path):
+            # Обратная совместимость со старым SQLite-кэшем
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA mmap_size=268435456')  # Чтение через mmap
+            self.nomenclature_df = pl.read_database('SELECT * FROM nomenclature', conn)
+            conn.close()
+        else:
+            self.nomenclature_df = pl.read_excel(path)
+            try:
+                self.nomenclature_df.write_parquet(parquet_path)
+            except OSError:
+                pass    # Кэш — только оптимизация
+
+        # Добавление недостающих колонок
+        required_cols = ['Номенклатура', 'Код', 'Оформлено',
+                         'ТоварПроизводителя', 'ОсновнойАссортимент']
+        missing = [col for col in required_cols
+                   if col not in self.nomenclature_df.columns]
+        if missing:
+            self.nomenclature_df = self.nomenclature_df.with_columns(
+                [pl.lit('Нет').alias(col) for col in missing] # Значение по умолчанию
+            )
+
+        # Статусы всех позиций считаются один раз на загрузку
+        self._status_arr = self._build_status_arr()
+
+        # Построение (или чтение из кэша) индекса BM25 для загруженного файла
+        self._nomenclature_key = (str(path), os.path.getmtime(path))
+        index = self.bm25_state
+        self.nomenclature_df = self.nomenclature_df.with_columns(
+            index.processed.alias('processed')
+        )
+
+    def _build_status_arr(self):
+        """Строит массив готовых строк статусов по всем позициям.
+            Три флага дают 8 комбинаций — строки берутся из таблицы
+            по битовому коду, без сборки строки на каждую позицию.
+            """
+        flag_o = self.nomenclature_df['Оформлено'].to_numpy() == 'Да'
+        flag_t = self.nomenclature_df['ТоварПроизводителя'].to_numpy() == 'Да'
+        flag_a = self.nomenclature_df['ОсновнойАссортимент'].to_numpy() == 'Да'
+        codes = (flag_o.astype(np.int8)
+                 + 2 * flag_t.astype(np.int8)
+                 + 4 * flag_a.astype(np.int8))
+
+        lut = np.empty(8, dtype=object)
+        named_bits = ((1, "Оформлено"), (2, "Товар Производителя"),
+                      (4, "Основной Ассортимент"))
+        for code in range(8):
+            labels = [name for bit, name in named_bits if code & bit]
+            lut[code] = ", ".join(labels) if labels else "—"
+        return lut[codes]
+
+    @property
+    def bm25_state(self):
+        """Состояние BM25 текущей номенклатуры (лениво, через кэши)."""
+        return self._get_bm25_index()
+
+    def _build_bm25_index(self):
+        """Строит индекс BM25 по текущей номенклатуре.
+                Returns:
+                    BM25State: Предобработанные названия, токены и индекс.
+                """
+        # Предобработка всей колонки векторными строковыми операциями polars
+        # (fill_null — пустые названия не должны ронять токенизацию)
+        processed = (self.nomenclature_df['Номенклатура'].cast(pl.String)
+                     .fill_null('')
+                     .str.to_lowercase()
+                     .str.replace_all(r'[^\w\s]+', '')
+                     .map_elements(self._apply_replacements, return_dtype=pl.String))
+        tokenized = [text.split() for text in processed]
+        return BM25State(
+            processed=processed,
+            tokenized=tokenized,
+            # Склеенные токены для векторного бонуса за совпадение начала
+            joined=np.array([' '.join(tokens) for tokens in tokenized], dtype=str),
+            **self._build_bm25_matrix(tokenized)
+        )
+
+    def _build_bm25_matrix(self, tokenized, k1=1.5, b=0.75):
+        """Строит разреженную матрицу готовых весов BM25.
+                Args:
+                    tokenized (list): Список списков токенов по документам.
+                    k1, b (float): Стандартные параметры BM25.
+                Returns:
+                    dict: Словарь терм -> индекс, CSR-матрица
+                        (документы × словарь) с весами
+                        idf * tf * (k1+1) / (tf + k1 * (1 - b + b * dl / avgdl))
+                        и сырые массивы (idf, списки вхождений, длины
+                        документов) для JIT-ядра numba.
+                """
+        num_docs = len(tokenized)
+        doc_len = np.array([len(tokens) for tokens in tokenized], dtype=np.float64)
+        avgdl = doc_len.mean() if num_docs else 1.0
+
+        # Частоты термов по документам в COO-формате
+        vocab = {}
+        rows, cols, tfs = [], [], []
+        for doc_id, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                rows.append(doc_id)
+                cols.append(vocab.setdefault(term, len(vocab)))
+                tfs.append(tf)
+
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        tfs = np.array(tfs, dtype=np.float64)
+
+        # IDF по документной частоте (неотрицательный вариант)
+        doc_freq = np.bincount(cols, minlength=len(vocab))
+        idf = np.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        # Знаменатель зависит только от документа — считается один раз
+        doc_denom = k1 * (1 - b + b * doc_len / avgdl)
+        weights = idf[cols] * tfs * (k1 + 1) / (tfs + doc_denom[rows])
+
+        # Квантование: float32 хватает для оценок 0-100, частоты термов
+        # и длины строк номенклатуры укладываются в uint16 — вдвое меньше
+        # трафика памяти и вдвое шире SIMD-векторизация
+        matrix = sparse.csr_matrix(
+            (weights.astype(np.float32), (rows, cols)),
+            shape=(num_docs, len(vocab))
+        )
+
+        # Максимальный вклад каждого терма — верхняя граница для MaxScore
+        max_contrib = self._max_contrib_from_matrix(weights, cols, len(vocab))
+
+        # Потермовые списки вхождений (CSC: терм -> документы) для numba
+        tf_csc = sparse.csr_matrix(
+            (tfs, (rows, cols)), shape=(num_docs, len(vocab))
+        ).tocsc()
+
+        return {
+            'vocab': vocab,
+            'matrix': matrix,
+            'idf': idf.astype(np.float32),
+            'tf_indptr': tf_csc.indptr.astype(np.int64),
+            'tf_indices': tf_csc.indices.astype(np.int64),
+            'tf_data': tf_csc.data.astype(np.uint16),
+            'doc_len': doc_len.astype(np.uint16),
+            'avgdl': avgdl,
+            'k1': k1,
+            'b': b,
+            # Предвычисленные float32-массивы для JIT-ядра:
+            # числитель idf*(k1+1) и документная часть знаменателя
+            'idf_k1': (idf * (k1 + 1)).astype(np.float32),
+            'k1_k_d': (doc_denom).astype(np.float32),
+            'max_contrib': max_contrib
+        }
+
+    @staticmethod
+    def _normalize_scores(scores):
+        """Нормализует оценки BM25 в диапазон 0-100.
+                Args:
+                    scores (np.ndarray): Сырые оценки по документам.
+                Returns:
+                    np.ndarray: Нормализованные оценки.
+                """
+        min_score, max_score = scores.min(), scores.max()
+        if max_score == min_score:
+            # Вырожденный случай: все оценки одинаковы
+            return np.full(len(scores), 100.0 if max_score > 0 else 0.0)
+        return (scores - min_score) / (max_score - min_score) * 100
+
+    def _score_queries(self, index, queries, top_k=None):
+        """Считает оценки BM25 для пакета запросов одним умножением матриц.
+                Args:
+                    index (BM25State): Индекс из _build_bm25_index.
+                    queries (list): Список списков токенов запросов.
+                    top_k (int, optional): Сколько лучших документов нужно
+                        вызывающему коду. Позволяет JIT-ядру отсекать
+                        бесперспективные документы (MaxScore). Допустимо
+                        только если итоговый отбор идет по самой оценке
+                        BM25: оценки вне top_k занижены.
+                Returns:
+                    np.ndarray: Матрица оценок (запросы × документы).
+                """
+        vocab = index.vocab
+        rows, cols = [], []
+        for query_id, tokens in enumerate(queries):
+            for term in set(tokens):
+                term_id = vocab.get(term)
+                if term_id is not None:
+                    rows.append(query_id)
+                    cols.append(term_id)
+
+        if _numba_scorer_enabled:
+            # Плоские массивы терм-индексов запросов в формате CSR
+            # (rows уже отсортированы — запросы обходятся по порядку)
+            counts = np.bincount(np.array(rows, dtype=np.int64), minlength=len(queries))
+            query_indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            query_term_ids = np.array(cols, dtype=np.int64)
+
+            out = np.zeros((len(queries), len(index.doc_len)), dtype=np.float32)
+            if top_k is not None:
+                _bm25_scores_batch_pruned(
+                    query_indptr, query_term_ids, index.idf_k1,
+                    index.tf_indptr, index.tf_indices, index.tf_data,
+                    index.k1_k_d, index.max_contrib, top_k, out
+                )
+            else:
+                _bm25_scores_batch(
+                    query_indptr, query_term_ids, index.idf_k1,
+                    index.tf_indptr, index.tf_indices, index.tf_data,
+                    index.k1_k_d, out
+                )
+            return out
+
+        query_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(queries), len(vocab))
+        )
+        return np.asarray((query_matrix @ index.matrix.T).todense())
+
+    def _get_bm25_index(self):
+        """Возвращает индекс BM25 из кэша по ключу (путь, mtime).
+            Порядок поиска: кэш в памяти -> файл .bm25.npz на диске ->
+            полное построение (с сохранением на диск). Пересобирает
+            индекс, если Excel-файл изменился или данные загружены
+            не из файла.
+            """
+        key = self._nomenclature_key
+        if key is not None and key in self._bm25_cache:
+            return self._bm25_cache[key]
+
+        index = self._load_bm25_index(key[0]) if key is not None else None
+        if index is None:
+            index = self._build_bm25_index()
+            if key is not None:
+                self._save_bm25_index(index, key[0])
+        if key is not None:
+            self._bm25_cache[key] = index
+        return index
+
+    @staticmethod
+    def _index_cache_path(path):
+        """Путь к дисковому кэшу индекса BM25 рядом с базой."""
+        return Path(path).with_suffix('.bm25.npz')
+
+    def _save_bm25_index(self, index, path):
+        """Сохраняет индекс BM25 на диск (.bm25.npz) с отпечатком файла.
+                Args:
+                    index (BM25State): Индекс из _build_bm25_index.
+                    path (str): Путь к исходному Excel-файлу.
+                """
+        stat = os.stat(path)
+        matrix = index.matrix
+        # Термы словаря в порядке их индексов
+        terms = np.array(sorted(index.vocab, key=index.vocab.get), dtype=str)
+        try:
+            np.savez_compressed(
+                self._index_cache_path(path),
+                fingerprint=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+                params=np.array([index.avgdl, index.k1, index.b]),
+                processed=np.asarray(index.processed.to_list(), dtype=str),
+                terms=terms,
+                idf=index.idf,
+                doc_len=index.doc_len,
+                tf_indptr=index.tf_indptr,
+                tf_indices=index.tf_indices,
+                tf_data=index.tf_data,
+                w_indptr=matrix.indptr,
+                w_indices=matrix.indices,
+                w_data=matrix.data
+            )
+        except OSError:
+            pass    # Кэш — только оптимизация: нет места/прав — работаем без него
+
+    def _load_bm25_index(self, path):
+        """Читает индекс BM25 с диска, если отпечаток Excel-файла совпадает.
+                Returns:
+                    BM25State | None: Индекс или None (кэша нет / он устарел).
+                """
+        cache_path = self._index_cache_path(path)
+        try:
+            stat = os.stat(path)
+            data = np.load(cache_path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+        # Инвалидация при изменении исходного файла
+        if not np.array_equal(data['fingerprint'],
+                              [stat.st_size, stat.st_mtime_ns]):
+            return None
+
+        processed = pl.Series('processed', data['processed'])
+        tokenized = [text.split() for text in processed]
+        vocab = {term: term_id for term_id, term in enumerate(data['terms'])}
+        avgdl, k1, b = data['params']
+
+        idf = data['idf']
+        doc_len = data['doc_len']
+        doc_denom = k1 * (1 - b + b * doc_len / avgdl)
+        return BM25State(
+            processed=processed,
+            tokenized=tokenized,
+            joined=np.array([' '.join(tokens) for tokens in tokenized], dtype=str),
+            vocab=vocab,
+            matrix=sparse.csr_matrix(
+                (data['w_data'], data['w_indices'], data['w_indptr']),
+                shape=(len(tokenized), len(vocab))
+            ),
+            idf=idf,
+            tf_indptr=data['tf_indptr'],
+            tf_indices=data['tf_indices'],
+            tf_data=data['tf_data'],
+            doc_len=doc_len,
+            avgdl=avgdl,
+            k1=k1,
+            b=b,
+            idf_k1=(idf * (k1 + 1)).astype(np.float32),
+            k1_k_d=doc_denom.astype(np.float32),
+            max_contrib=self._max_contrib_from_matrix(
+                data['w_data'], data['w_indices'], len(vocab))
+        )
+
+    @staticmethod
+    def _max_contrib_from_matrix(weights, term_ids, vocab_size):
+        """Восстанавливает верхние границы вкладов термов из весов матрицы."""
+        max_contrib = np.zeros(vocab_size)
+        np.maximum.at(max_contrib, term_ids, weights)
+        max_contrib *= 1 + 1e-4
+        return max_contrib.astype(np.float32)
+
+    def save_results(self, results, path):
+        """Сохраняет результаты поиска в файл (Excel/CSV).
+            Args:
+                results (list): Список словарей с результатами.
+                path (str): Путь для сохранения файла.
+            """
+        df = pl.DataFrame(results)
+
+        # Конвертация строковых значений 'Сходство' в числовой формат
+        if 'Сходство' in df.columns:
+            df = df.with_columns(pl.col('Сходство').cast(pl.Float64))
+
+        # Выбор формата экспорта с учетом локализации для CSV
+        if path.endswith('.xlsx'):
+            df.write_excel(path)
+        elif path.endswith('.csv'):
+            # Использование ';' как разделителя и ',' для десятичных
+            if 'Сходство' in df.columns:
+                df = df.with_columns(
+                    pl.col('Сходство').cast(pl.String)
+                    .str.replace('.', ',', literal=True)
+                )
+            df.write_csv(path, separator=';')
+        else:
+            raise ValueError("Неподдерживаемый формат файла")
+
+    def update_progress(self, current, total):
+        pass
+
+    def process_grouped_requests(self, selected_columns, priority, top_n):
+        """Обрабатывает группированные запросы.
+                Args:
+                    selected_columns (list): Колонки для группировки.
+                    priority (str): Приоритет сортировки (например, 'Оформлено').
+                    top_n (int): Количество возвращаемых вариантов.
+                Returns:
+                    list: Результаты поиска.
+                """
+        # Проверка загрузки данных
+        if self.request_df is None or self.nomenclature_df is None:
+            raise ValueError("Данные не загружены")
+
+        # Ленивый конвейер polars: ключ группы и сбор частей запроса
+        # считаются одним потоковым запросом без промежуточных таблиц
+        group_table = (
+            self.request_df.lazy()
+            .with_columns(
+                pl.concat_str([pl.col(col).cast(pl.String) for col in selected_columns],
+                              separator=' | ', ignore_nulls=True).alias('combined_key'),
+                pl.concat_list([pl.col(col).cast(pl.String) for col in selected_columns])
+                .alias('query_parts')
+            )
+            .group_by('combined_key', maintain_order=True)
+            .agg(pl.col('query_parts').flatten().drop_nulls())
+            .collect(engine='streaming')
+        )
+
+        # Получение индекса BM25 из кэша (строится один раз на файл)
+        index = self.bm25_state
+
+        # Массив приоритета считается один раз вне цикла по группам
+        priority_arr = (self.nomenclature_df[priority].to_numpy() == 'Да').astype(np.int8)
+
+        # Колонки номенклатуры как numpy-массивы для построения результатов
+        columns = {col: self.nomenclature_df[col].to_numpy()
+                   for col in ('Номенклатура', 'Код')}
+        status_arr = (self._status_arr if self._status_arr is not None
+                      else self._build_status_arr())
+
+        results = []
+        total_groups = group_table.height
+
+        # Формирование уникальных запросов всех групп
+        group_names = []
+        queries = []
+        query_prefixes = []     # Склеенные токены для бонуса за начало
+        for group_name, query_parts in group_table.iter_rows():
+            # Дедупликация с сохранением порядка за O(N)
+            unique_query = ' '.join(dict.fromkeys(query_parts))
+            tokens = self.preprocess_text(unique_query).split()
+            group_names.append(group_name)
+            queries.append(tokens)
+            query_prefixes.append(' '.join(tokens))
+
+        # Расчет релевантности всех групп одним пакетом
+        # (одно умножение матриц вместо вызова на каждую группу).
+        # Без top_k: итоговый отбор идет по приоритету и бонусу за начало,
+        # поэтому отсечение MaxScore по сырой оценке здесь некорректно —
+        # заниженный хвост мог бы вытеснить приоритетные позиции.
+        all_scores = self._score_queries(index, queries)
+
+        # Постобработка групп независима — распараллеливается по потокам
+        # (numpy-операции отпускают GIL); прогресс — через общий счетчик
+        completed = 0
+        progress_lock = threading.Lock()
+
+        def process_group(group_idx):
+            nonlocal completed
+            group_name = group_names[group_idx]
+            group_results = []
+            scores = all_scores[group_idx]
+
+            # Нормализация оценок и бонус за совпадение начала
+            normalized = self._normalize_scores(scores)
+            prefix_match = np.char.startswith(index.joined, query_prefixes[group_idx])
+            normalized = np.minimum(normalized + 5 * prefix_match, 100)
+
+            # Отбор top_n*2 лучших одним argpartition вместо полной сортировки
+            # (взято в 2 раза больше для отсева дубликатов)
+            take = min(top_n * 2, len(normalized))
+            sort_key = priority_arr * 1e6 + normalized
+            top_idx = np.argpartition(-sort_key, take - 1)[:take]
+            top_idx = top_idx[np.argsort(-sort_key[top_idx])]
+
+            # Фильтрация дубликатов по коду (без iterrows — прямой доступ
+            # к numpy-массивам колонок по индексу документа)
+            unique_codes = set()
+            for doc_idx in top_idx:
+                code = columns['Код'][doc_idx]
+                if code in unique_codes:
+                    continue
+
+                group_results.append({
+                    'Запрос': group_name,
+                    'Номенклатура': columns['Номенклатура'][doc_idx],
+                    'Код': code,
+                    'Сходство': normalized[doc_idx],
+                    'Статус': status_arr[doc_idx]
+                })
+                unique_codes.add(code)
+                if len(unique_codes) >= top_n:
+                    break
+
+            with progress_lock:
+                completed += 1
+                self.update_progress(completed, total_groups)
+            return group_results
+
+        if JOBLIB_AVAILABLE and total_groups > 1:
+            group_lists = Parallel(n_jobs=-1, backend='threading')(
+                delayed(process_group)(group_idx)
+                for group_idx in range(total_groups)
+            )
+        else:
+            group_lists = [process_group(group_idx)
+                           for group_idx in range(total_groups)]
+
+        # Результаты собираются в исходном порядке групп
+        for group_results in group_lists:
+            results.extend(group_results)
+
+        return results
+
+    def load_request_data(self, path):
+        """Загружает данные клиентской заявки из Excel.
+            Особенности:
+            - Автоматически определяет строку с заголовками
+            - Игнорирует технические колонки ('Unnamed')
+            - Заполняет пропущенные значения предыдущими
+            """
+
+        # Поиск заголовка в первых 10 строках
+        temp_df = pl.read_excel(path, has_header=False, read_options={'n_rows': 10})
+        header_row = self.find_header_row(temp_df)
+
+        # Чтение данных с фильтрацией ненужных колонок
+        self.request_df = (
+            pl.read_excel(path, read_options={'header_row': header_row})
+            # Игнорирование служебных колонок без заголовка
+            .select(pl.exclude('^(__UNNAMED__|Unnamed).*$'))
+            # Удаление пустых строк и заполнение пропусков предыдущими
+            .filter(~pl.all_horizontal(pl.all().is_null()))
+            .fill_null(strategy='forward')
+        )
+
+    def find_header_row(self, df):
+        """Ищет строку с заголовками таблицы по наличию слова 'товар'.
+            Возвращает:
+                int: Номер строки с заголовком (0 если не найден).
+            """
+        for idx, row in enumerate(df.iter_rows()):
+            if any('товар' in str(cell).lower() for cell in row):
+                return idx
+        return 0  # Возврат первой строки как заголовка по умолчанию
+
+    def preprocess_text(self, text):
+        """Предобработка текста для поиска:
+            1. Приведение к нижнему регистру
+            2. Удаление спецсимволов (остаются буквы, цифры и пробелы)
+            3. Замена слов по словарю сокращений
+            """
+        text = self._nonword_re.sub('', str(text).lower())
+        return self._apply_replacements(text)
+
+    def _apply_replacements(self, text):
+        """Применяет словарь сокращений за один проход по строке.
+            Использует автомат Ахо-Корасик (pyahocorasick), если он
+            установлен, иначе — альтернацию регулярных выражений.
+            """
+        if self._aho is None:
+            return self._replace_re.sub(self._replace_match, text)
+
+        parts = []
+        last_end = 0
+        for end_idx, (length, value) in self._aho.iter_long(text):
+            start = end_idx - length + 1
+            parts.append(text[last_end:start])
+            parts.append(value)
+            last_end = end_idx + 1
+        parts.append(text[last_end:])
+        return ''.join(parts)
+
+    def process_data(self, column_name, priority_var, top_n, progress_callback=None):
+        """Основной метод обработки данных. Этапы:
+            1. Препроцессинг названий товаров
+            2. Построение модели BM25
+            3. Итеративная обработка каждого запроса
+            4. Нормализация оценок и добавление бонусов
+            5. Фильтрация и сохранение результатов
+            """
+
+        # Получение индекса BM25 из кэша (строится один раз на файл)
+        index = self.bm25_state
+
+        # Массив приоритета считается один раз вне цикла по запросам
+        priority_arr = (self.nomenclature_df[priority_var].to_numpy() == 'Да').astype(np.int8)
+
+        # Колонки номенклатуры как numpy-массивы для построения результатов
+        columns = {col: self.nomenclature_df[col].to_numpy()
+                   for col in ('Номенклатура', 'Код')}
+        status_arr = (self._status_arr if self._status_arr is not None
+                      else self._build_status_arr())
+
+        results = []
+        total_queries = len(self.request_df[column_name])
+        processed_count = 0
+        for idx, query in enumerate(self.request_df[self.column_var.get()]):
+            if self.cancel_flag:
+                break  # Прерывание при отмене
+
+            processed_query = self.preprocess_text(query).split()
+            scores = self._score_queries(index, [processed_query])[0]
+
+            # Нормализация оценок и бонус за совпадение начала строки
+            normalized = self._normalize_scores(scores)
+            prefix_match = np.char.startswith(index.joined, ' '.join(processed_query))
+            normalized = np.minimum(normalized + 5 * prefix_match, 100)
+
+            # Отбор топ-N лучших одним argpartition вместо полной сортировки
+            take = min(int(top_n), len(normalized))
+            sort_key = priority_arr * 1e6 + normalized
+            top_idx = np.argpartition(-sort_key, take - 1)[:take]
+            top_idx = top_idx[np.argsort(-sort_key[top_idx])]
+
+            # Формирование итоговой структуры (без iterrows — прямой доступ
+            # к numpy-массивам колонок по индексу документа)
+            for doc_idx in top_idx:
+                self.results.append({
+                    'Запрос': query,
+                    'Номенклатура': columns['Номенклатура'][doc_idx],
+                    'Код': columns['Код'][doc_idx],
+                    'Сходство': f"{normalized[doc_idx]:.2f}",
+                    'Статус': status_arr[doc_idx]
+                })
+            # Дополнительное обновление прогресса каждые 10 запросов
+            processed_count += 1
+            if processed_count % 10 == 0 or processed_count == total_queries:
+                progress = processed_count / total_queries * 100
+                if progress_callback:
+                    progress_callback(progress)
+        return results
+
+    def get_status(self, row):
+        """Формирует строку статусов товара на основе флагов.
+            Возможные статусы:
+            - Оформлено
+            - Товар Производителя
+            - Основной Ассортимент
+            """
+        status = []
+        if row['Оформлено'] == 'Да': status.append("Оформлено")
+        if row['ТоварПроизводителя'] == 'Да': status.append("Товар Производителя")
+        if row['ОсновнойАссортимент'] == 'Да': status.append("Основной Ассортимент")
         return ", ".join(status) if status else "—"
\ No newline at end of file
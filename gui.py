@@ -150,9 +150,14 @@ class NomenclatureApp:
         self.check_progress_queue() # Запуск цикла проверки очереди
 
     def check_progress_queue(self):
-        """Обновление прогресс-бара из очереди каждые 100 мс."""
+        """Обновление прогресс-бара из очереди каждые 100 мс.
+            Очередь сливается до последнего значения — один апдейт виджета
+            на тик, чтобы не заваливать цикл событий Tk при тысячах групп.
+            """
+        value = None
         while not self.progress_queue.empty():
             value = self.progress_queue.get()
+        if value is not None:
             self.progress["value"] = value
             self.root.update_idletasks()
         self.root.after(100, self.check_progress_queue) # Рекурсивный вызов
@@ -271,21 +276,32 @@ class NomenclatureApp:
                 messagebox.showerror("Ошибка", f"Ошибка сохранения: {str(e)}")
 
     def update_results_table(self):
-        """Обновление таблицы с результатами."""
-
-        # Очистка предыдущих данных
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # Добавление новых записей
-        for result in self.results:
-            self.tree.insert("", "end", values=(
-                result['Запрос'],
-                result['Номенклатура'],
-                result['Код'],
-                result['Сходство'],
-                result['Статус']
-            ))
+        """Обновление таблицы с результатами.
+            Кортежи строк готовятся заранее, а колонки таблицы скрываются
+            на время массовой вставки — Tk не перерисовывает содержимое на
+            каждую строку, и тысячи записей не блокируют главный цикл.
+            """
+
+        # Предварительное форматирование всех строк
+        rows = [
+            (result['Запрос'],
+             result['Номенклатура'],
+             result['Код'],
+             result['Сходство'],
+             result['Статус'])
+            for result in self.results
+        ]
+
+        def insert_rows():
+            self.tree.configure(displaycolumns=())  # Без перерисовок во время вставки
+            try:
+                self.tree.delete(*self.tree.get_children())
+                for values in rows:
+                    self.tree.insert("", "end", values=values)
+            finally:
+                self.tree.configure(displaycolumns="#all")
+
+        self.root.after_idle(insert_rows)
 
     def cancel_processing(self):
         """Остановка текущей обработки."""